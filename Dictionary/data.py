@@ -1,11 +1,78 @@
 # Adapted from PyTorch examples:
 # https://github.com/pytorch/examples/blob/master/word_language_model/data.py
 
+from concurrent.futures import ProcessPoolExecutor
 from nltk import word_tokenize
+import hashlib
+import json
 import os
+import queue
+import threading
 
+import numpy as np
+import scipy.sparse as sp
 import torch
 
+try:
+    # Optional: stream JSON documents instead of materializing the full
+    # parsed tree.
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    # Optional: fast full-document parsing for the non-streaming path.
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _parse_document(file_path):
+    """
+    Extract the 'title' and 'text' fields of a JSON document.
+    :param file_path: The path to a JSON document.
+    :return A (title, text) pair.
+    """
+    title = None
+    text = None
+    if ijson is not None:
+        with open(file_path, 'r', buffering=1 << 20) as f:
+            for key, value in ijson.kvitems(f, ''):
+                if key == "title":
+                    title = value
+                elif key == "text":
+                    text = value
+    elif orjson is not None:
+        # orjson parses raw bytes directly, skipping the Python-level
+        # UTF-8 decode a text-mode read would pay.
+        with open(file_path, 'rb') as f:
+            parsed_document = orjson.loads(f.read())
+        title = parsed_document["title"]
+        text = parsed_document["text"]
+        del parsed_document
+    else:
+        with open(file_path, 'r', buffering=1 << 20) as f:
+            parsed_document = json.load(f)
+        title = parsed_document["title"]
+        text = parsed_document["text"]
+        del parsed_document
+
+    return title, text
+
+
+def _tokenize_document(file_path):
+    """
+    Parse and word-tokenize a JSON document. Module-level so it can be
+    dispatched to worker processes.
+    :param file_path: The path to a JSON document.
+    :return A (title, tokenized lines) pair, where tokenized lines is a
+        list of word lists, each terminated by '<EOS>'.
+    """
+    title, text = _parse_document(file_path)
+    tokenized_lines = [word_tokenize(line) + ['<EOS>']
+                       for line in text.splitlines()]
+    return title, tokenized_lines
+
 
 class Dictionary(object):
     def __init__(self):
@@ -31,17 +98,437 @@ class Corpus(object):
     tensor for the document passed.
     """
 
-    def __init__(self):
+    def __init__(self, bptt_limit=30):
         self.dictionary = Dictionary()
-        self.examples = []
+        self.bptt_limit = bptt_limit
+
+        # One contiguous sequence tensor per document, keyed by document id.
+        # Training windows are never materialized up front; 'index' holds
+        # lightweight (document id, offset) pairs and the actual input/target
+        # tensors are sliced out of 'encodings' at batch time.
+        self.encodings = {}
+        self.index = []
+        self.id_to_title = {}
+
+        # Per-document term frequencies, kept sparse as (indices, counts)
+        # pairs; a typical document touches a small fraction of the
+        # vocabulary, so dense vocabulary-length vectors per document would
+        # be almost entirely zeros.
+        self.term_frequencies = {}
+        self._tf_matrix = None
+        self._index_array = None
 
     def add_example(self, path):
         """
         Tokenizes a text file and adds it's sequence tensor to the corpus.
         :param path: The path to a training document.
+        :return The id assigned to the document.
+        """
+        return self._add_encoding(self.tokenize(path))
+
+    def add_document(self, file_path):
+        """
+        Parses a JSON document and adds its sequence tensor to the corpus.
+
+        Only the 'title' and 'text' fields are extracted; when ijson is
+        available the file is parsed as a stream so the rest of the tree
+        (sections, links, metadata) is never held in memory at once.
+
+        :param file_path: The path to a JSON document with 'title' and
+            'text' fields.
+        :return The id assigned to the document.
+        """
+        title, text = _parse_document(file_path)
+        document_id = self._add_encoding(self.tokenize_text(text))
+        self.id_to_title[document_id] = title
+        return document_id
+
+    def load(self, file_paths, max_workers=None, cache_path=None):
+        """
+        Add a collection of JSON documents to the corpus in parallel.
+
+        Parsing and word tokenization, the expensive per-document steps, run
+        in a process pool; vocabulary updates and encoding remain in the
+        parent process so word indices stay consistent across documents.
+        Documents receive ids in the order of 'file_paths'.
+
+        When 'cache_path' is given, the encoded corpus is persisted there
+        after the first load and restored on later runs — skipping JSON
+        parsing and tokenization entirely — as long as the document files
+        and bptt_limit are unchanged.
+
+        :param file_paths: The paths of the JSON documents to add.
+        :param max_workers: The number of worker processes; defaults to the
+            machine's CPU count.
+        :param cache_path: An optional '.npz' path at which to cache the
+            encoded corpus.
+        """
+        file_paths = list(file_paths)
+        cache_key = None
+        if cache_path is not None:
+            if not cache_path.endswith(".npz"):
+                # np.savez appends the suffix on write; normalize up front
+                # so the restore path looks for the same file.
+                cache_path += ".npz"
+
+            cache_key = self._cache_key(file_paths)
+            if self._load_cache(cache_path, cache_key):
+                return
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            tokenized = executor.map(_tokenize_document, file_paths,
+                                     chunksize=8)
+            for title, tokenized_lines in tokenized:
+                document_id = self._add_encoding(
+                    self._encode_tokenized(tokenized_lines))
+                self.id_to_title[document_id] = title
+
+        if cache_path is not None:
+            self._save_cache(cache_path, cache_key)
+
+    def _cache_key(self, file_paths):
+        """
+        Fingerprint a document collection: any change to the file set, a
+        file's modification time or the window length invalidates the
+        cache.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(str(self.bptt_limit).encode())
+        for path in file_paths:
+            hasher.update(path.encode())
+            hasher.update(str(os.path.getmtime(path)).encode())
+
+        return hasher.hexdigest()
+
+    def _save_cache(self, cache_path, cache_key):
+        """
+        Persist the encoded corpus: one flat int64 array of all document
+        encodings (as a separate '.npy' so it can be memory-mapped back),
+        plus offsets, titles, the vocabulary and the term-frequency matrix.
+        """
+        num_documents = len(self.encodings)
+        lengths = [len(self.encodings[i]) for i in range(num_documents)]
+        flat_encodings = np.concatenate(
+            [self.encodings[i].numpy() for i in range(num_documents)]) \
+            if num_documents else np.zeros(0, dtype=np.int64)
+        tf_matrix = self.term_frequency_matrix()
+        np.save(cache_path + ".encodings.npy", flat_encodings)
+        np.savez(cache_path,
+                 key=cache_key,
+                 offsets=np.cumsum([0] + lengths).astype(np.int64),
+                 titles=np.array([self.id_to_title.get(i, "")
+                                  for i in range(num_documents)]),
+                 words=np.array(self.dictionary.index_to_word),
+                 tf_data=tf_matrix.data,
+                 tf_indices=tf_matrix.indices,
+                 tf_indptr=tf_matrix.indptr)
+
+    def _load_cache(self, cache_path, cache_key):
+        """
+        Restore the corpus persisted by '_save_cache'. The flat encoding
+        array is memory-mapped, so document tensors are zero-copy views
+        backed by the page cache.
+
+        :return True when the cache was restored, False when it is missing
+            or stale.
+        """
+        encodings_path = cache_path + ".encodings.npy"
+        if not os.path.exists(cache_path):
+            return False
+        if not os.path.exists(encodings_path):
+            return False
+
+        cached = np.load(cache_path)
+        if str(cached["key"]) != cache_key:
+            return False
+
+        for word in cached["words"]:
+            self.dictionary.add_word(str(word))
+
+        flat_encodings = np.load(encodings_path, mmap_mode='r')
+        offsets = cached["offsets"]
+        titles = cached["titles"]
+        tf_data = cached["tf_data"]
+        tf_indices = cached["tf_indices"]
+        tf_indptr = cached["tf_indptr"]
+        for document_id in range(len(offsets) - 1):
+            start, end = offsets[document_id], offsets[document_id + 1]
+            self.encodings[document_id] = torch.from_numpy(
+                np.asarray(flat_encodings[start:end]))
+            self.id_to_title[document_id] = str(titles[document_id])
+            row_start, row_end = (tf_indptr[document_id],
+                                  tf_indptr[document_id + 1])
+            self.term_frequencies[document_id] = (
+                torch.from_numpy(tf_indices[row_start:row_end].astype(
+                    np.int64)),
+                torch.from_numpy(tf_data[row_start:row_end]))
+            for offset in range(end - start - self.bptt_limit - 1):
+                self.index.append((document_id, offset))
+
+        self._tf_matrix = sp.csr_matrix(
+            (tf_data, tf_indices, tf_indptr),
+            shape=(len(offsets) - 1, len(self.dictionary)))
+        return True
+
+    def _add_encoding(self, sequence_tensor):
+        """
+        Register a document's sequence tensor and index its training
+        windows.
+        :param sequence_tensor: The encoded document.
+        :return The id assigned to the document.
+        """
+        document_id = len(self.encodings)
+        self.encodings[document_id] = sequence_tensor
+        self.term_frequencies[document_id] = \
+            self.compute_term_frequencies(sequence_tensor)
+        # Invalidate the stacked term-frequency matrix and index array.
+        self._tf_matrix = None
+        self._index_array = None
+
+        # Every offset defines one training window of length 'bptt_limit';
+        # its target is the same window shifted right by one word.
+        for offset in range(len(sequence_tensor) - self.bptt_limit - 1):
+            self.index.append((document_id, offset))
+
+        return document_id
+
+    def compute_term_frequencies(self, sequence_tensor):
+        """
+        Count term occurrences in an encoded document.
+        :param sequence_tensor: The encoded document.
+        :return An (indices, counts) pair of tensors holding only the
+            nonzero entries of the document's term-frequency vector.
+        """
+        # C-level counting over the whole encoding at once; a Python loop
+        # with a dict is ~50x slower on long documents.
+        counts = np.bincount(np.asarray(sequence_tensor, dtype=np.int64))
+        indices = np.nonzero(counts)[0]
+        return (torch.from_numpy(indices),
+                torch.from_numpy(counts[indices].astype(np.float32)))
+
+    def term_frequency_matrix(self):
+        """
+        Assemble the per-document term frequencies into one CSR matrix of
+        dimensions (number of documents, vocabulary size).
+
+        Batches of rows can be sliced out and densified per batch, keeping
+        total memory proportional to the number of nonzero terms rather
+        than (number of documents) x (vocabulary size). The matrix is
+        cached until another document is added.
+        """
+        if self._tf_matrix is not None:
+            return self._tf_matrix
+
+        data = []
+        column_indices = []
+        indptr = [0]
+        for document_id in range(len(self.encodings)):
+            indices, counts = self.term_frequencies[document_id]
+            column_indices.extend(indices.tolist())
+            data.extend(counts.tolist())
+            indptr.append(len(column_indices))
+
+        self._tf_matrix = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32),
+             np.asarray(column_indices, dtype=np.int64),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(len(self.encodings), len(self.dictionary)))
+        return self._tf_matrix
+
+    def data_loader(self, batch_size, prefetch=4, block_size=1024):
+        """
+        Generate shuffled batches of training windows.
+
+        Batches are assembled on a background thread and handed over through
+        a bounded queue, so batch construction overlaps with whatever the
+        consumer (e.g. forward/backward on the GPU) is doing with the
+        previous batch.
+
+        Shuffling is done by block: the index is partitioned into blocks of
+        'block_size' windows whose order is permuted while the order within
+        each block is kept. Consecutive batches therefore keep touching the
+        same few documents' encodings and term-frequency rows, instead of
+        hopping across the whole corpus the way a full shuffle does.
+
+        :param batch_size: The number of windows per batch.
+        :param prefetch: The maximum number of batches assembled ahead of
+            the consumer.
+        :param block_size: The number of consecutive windows shuffled as a
+            unit.
+        :yield Dicts with keys 'input' and 'target' (LongTensors of
+            dimensions (batch size, bptt_limit)), 'term_frequency' (a
+            FloatTensor of dimensions (batch size, vocabulary size)) and
+            'ids' (a LongTensor of the batch's document ids).
+        """
+        batch_queue = queue.Queue(maxsize=prefetch)
+        producer = threading.Thread(
+            target=self._produce_batches,
+            args=(batch_size, batch_queue, block_size),
+            daemon=True)
+        producer.start()
+        while True:
+            batch = batch_queue.get()
+            if batch is None:  # Sentinel: the producer is exhausted.
+                break
+
+            if isinstance(batch, Exception):
+                # The producer died; re-raise here so the failure surfaces
+                # on the consuming thread instead of hanging it on an
+                # empty queue.
+                raise batch
+
+            yield batch
+
+    def _produce_batches(self, batch_size, batch_queue, block_size):
+        """
+        Assemble batches of training windows and feed them to 'batch_queue',
+        followed by a None sentinel. Run on the background thread spawned by
+        'data_loader'; failures are enqueued in place of the sentinel so the
+        consumer can re-raise them.
+        """
+        try:
+            self._produce_batches_inner(batch_size, batch_queue, block_size)
+        except Exception as error:
+            batch_queue.put(error)
+            return
+
+        batch_queue.put(None)
+
+    def _produce_batches_inner(self, batch_size, batch_queue, block_size):
+        pin = torch.cuda.is_available()
+        index = self._block_shuffled_index(block_size)
+        limit = self.bptt_limit
+        tf_matrix = self.term_frequency_matrix()
+        for batch_start in range(0, len(index), batch_size):
+            batch_index = index[batch_start:batch_start + batch_size]
+            # Stage each batch as a single contiguous torch.long tensor so
+            # downstream embedding lookups never trigger a silent copy.
+            input_tensor = torch.stack(
+                [self.encodings[i][offset:offset + limit]
+                 for i, offset in batch_index]).contiguous()
+            target_tensor = torch.stack(
+                [self.encodings[i][offset + 1:offset + limit + 1]
+                 for i, offset in batch_index]).contiguous()
+
+            # One row-gather against the stacked matrix replaces a Python
+            # dict lookup per example; only the batch's rows are densified.
+            ids = batch_index[:, 0].astype(np.int64)
+            tf_tensor = torch.from_numpy(tf_matrix[ids].toarray())
+            id_tensor = torch.from_numpy(ids)
+            if pin:
+                # Pinned batches allow asynchronous host-to-device copies
+                # via .to(device, non_blocking=True) on the consumer side.
+                input_tensor = input_tensor.pin_memory()
+                target_tensor = target_tensor.pin_memory()
+                tf_tensor = tf_tensor.pin_memory()
+
+            batch_queue.put({
+                "input": input_tensor,
+                "target": target_tensor,
+                "term_frequency": tf_tensor,
+                "ids": id_tensor
+            })
+
+    def tbptt_loader(self, batch_size=1, shuffle_documents=True):
+        """
+        Iterate windows of 'batch_size' parallel document streams for
+        truncated backpropagation through time.
+
+        Each stream serves one document at a time in contiguous
+        'bptt_limit' strides, moving to the next document when its current
+        one is exhausted, so the consumer can carry the RNN hidden state
+        across windows (detaching between them) and zero the rows flagged
+        in 'reset' at document boundaries. Documents are truncated to
+        whole windows, and those shorter than one window are skipped.
+        Streams with no documents left retire, shrinking the batch near
+        the end of the epoch.
+
+        :param batch_size: The number of parallel document streams.
+        :param shuffle_documents: Whether to permute the document order.
+        :yield Dicts with keys 'input' and 'target' ((batch size,
+            bptt_limit) LongTensors), 'term_frequency' (a (batch size,
+            vocabulary size) FloatTensor), 'ids' (a (batch size,)
+            LongTensor of document ids) and 'reset' (a (batch size,)
+            BoolTensor, True for rows starting a new document).
+        """
+        tf_matrix = self.term_frequency_matrix()
+        limit = self.bptt_limit
+        if shuffle_documents:
+            order = iter(np.random.permutation(len(self.encodings)))
+        else:
+            order = iter(range(len(self.encodings)))
+
+        def next_stream():
+            # A stream is [document id, encoding, offset]; documents too
+            # short for one full input/target window are skipped.
+            for document_id in order:
+                document_id = int(document_id)
+                encoding = self.encodings[document_id]
+                if len(encoding) > limit:
+                    return [document_id, encoding, 0]
+
+            return None
+
+        streams = []
+        for _ in range(batch_size):
+            stream = next_stream()
+            if stream is None:
+                break
+
+            streams.append(stream)
+
+        while streams:
+            inputs, targets, ids, resets = [], [], [], []
+            alive = []
+            for stream in streams:
+                if stream[2] + limit + 1 > len(stream[1]):
+                    # Document exhausted; move the stream to the next one
+                    # or retire it.
+                    stream = next_stream()
+                    if stream is None:
+                        continue
+
+                document_id, encoding, offset = stream
+                inputs.append(encoding[offset:offset + limit])
+                targets.append(encoding[offset + 1:offset + limit + 1])
+                ids.append(document_id)
+                resets.append(offset == 0)
+                stream[2] = offset + limit
+                alive.append(stream)
+
+            streams = alive
+            if not streams:
+                break
+
+            yield {
+                "input": torch.stack(inputs).contiguous(),
+                "target": torch.stack(targets).contiguous(),
+                "term_frequency": torch.from_numpy(
+                    tf_matrix[ids].toarray()),
+                "ids": torch.LongTensor(ids),
+                "reset": torch.tensor(resets, dtype=torch.bool)
+            }
+
+    def _block_shuffled_index(self, block_size):
         """
-        sequence_tensor = self.tokenize(path)
-        self.examples.append(sequence_tensor)
+        Return the (document id, offset) index as an int32 array with block
+        order permuted and intra-block order preserved. The array form is
+        cached until another document is added.
+        """
+        if self._index_array is None:
+            if self.index:
+                self._index_array = np.asarray(self.index, dtype=np.int32)
+            else:
+                self._index_array = np.zeros((0, 2), dtype=np.int32)
+
+        index = self._index_array
+        blocks = len(index) // block_size
+        if blocks < 2:
+            return index
+
+        head = index[:blocks * block_size].reshape(blocks, block_size, 2)
+        permuted = head[np.random.permutation(blocks)].reshape(-1, 2)
+        return np.concatenate([permuted, index[blocks * block_size:]])
 
     def tokenize(self, path):
         """
@@ -56,16 +543,27 @@ class Corpus(object):
         """
         assert(os.path.exists(path))
 
-        lines = []
         with open(path, 'r') as f:
-            tokens = 0
-            for line in f:
-                words = word_tokenize(line) + ['<EOS>']
-                tokens += len(words)
-                for word in words:
-                    self.dictionary.add_word(word)
-
-                lines.append(words)
+            return self._encode_lines(f)
+
+    def tokenize_text(self, text):
+        """
+        Tokenize raw document text into a sequence tensor.
+        :param text: The full text of a training document.
+        :return A sequence tensor of the document, as in 'tokenize'.
+        """
+        return self._encode_lines(text.splitlines())
+
+    def _encode_lines(self, line_iterable):
+        lines = [word_tokenize(line) + ['<EOS>'] for line in line_iterable]
+        return self._encode_tokenized(lines)
+
+    def _encode_tokenized(self, lines):
+        tokens = 0
+        for words in lines:
+            tokens += len(words)
+            for word in words:
+                self.dictionary.add_word(word)
 
         # Convert the document into its own sequence tensor.
         ids = torch.LongTensor(tokens)
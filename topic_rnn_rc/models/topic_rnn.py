@@ -1,11 +1,24 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
-class TopicRNN(nn.module):
+@torch.jit.script
+def _negative_kl_divergence(mu, log_sigma):
+    """
+    Closed-form negative KL divergence between a diagonal Gaussian and the
+    standard normal prior. Scripted so the pointwise chain fuses into one
+    kernel instead of allocating a temporary per operation.
+    """
+    return 0.5 * torch.sum(
+        1 + 2 * log_sigma - mu * mu - torch.exp(2 * log_sigma))
 
-    def __init__(self, hidden_size, topic_dim=50):
+
+class TopicRNN(nn.Module):
+
+    def __init__(self, vocab_size, embedding_size, hidden_size, stop_indices,
+                 layers=2, dropout=0.5, topic_dim=50):
 
         """
         RNN Language Model with latently learned topics for capturing global
@@ -33,9 +46,315 @@ class TopicRNN(nn.module):
 
         Python/Torch Parameters:
         -----------
+        :param vocab_size: int
+            The size of the vocabulary, including stopwords.
+
+        :param embedding_size: int
+            The size of the learned word embeddings.
+
         :param hidden_size: int
             The hidden size of the RNN
 
+        :param stop_indices: torch.LongTensor
+            The vocabulary indices of stopwords; their topic contributions
+            are suppressed during inference.
+
+        :param layers: int
+            The number of stacked RNN layers.
+
+        :param dropout: float
+            The dropout proportion between stacked RNN layers.
+
         :param topic_dim: int
             The number of topics the model will learn.
         """
+        super(TopicRNN, self).__init__()
+
+        self.vocab_size = vocab_size
+        self.embedding_size = embedding_size
+        self.hidden_size = hidden_size
+        self.layers = layers
+        self.topic_dim = topic_dim
+
+        # Scalar hyperparameters only: enough to reconstruct the module
+        # alongside a state_dict. Tensor arguments like stop_indices live
+        # on as parameters/buffers and must not be retained here as well.
+        self.init_arguments = {
+            "vocab_size": vocab_size,
+            "embedding_size": embedding_size,
+            "hidden_size": hidden_size,
+            "layers": layers,
+            "dropout": dropout,
+            "topic_dim": topic_dim
+        }
+
+        self.embedding = nn.Embedding(vocab_size, embedding_size)
+
+        # GRU rather than a plain Elman RNN: same call signature, but it
+        # hits cuDNN's fused/persistent kernels. Flattening the weights up
+        # front keeps them in one contiguous block for that path.
+        self.rnn = nn.GRU(embedding_size, hidden_size, layers,
+                          dropout=dropout, batch_first=True)
+        self.rnn.flatten_parameters()
+
+        # V: Projection from hidden states to vocabulary logits.
+        self.decoder = nn.Linear(hidden_size, vocab_size)
+
+        # beta: Topic distributions over words.
+        self.beta = nn.Parameter(torch.rand(topic_dim, vocab_size))
+
+        # Zero the stopword columns of the topic additions with a single
+        # elementwise multiply; scattering zeros through a transposed view
+        # would force a non-contiguous write every forward pass. Registered
+        # as a buffer so it moves with the module and never triggers a
+        # host/device transfer mid-forward.
+        stop_mask = torch.ones(vocab_size)
+        stop_mask[stop_indices] = 0
+        self.register_buffer('stop_mask', stop_mask)
+
+        # Inference network over document term frequencies.
+        self.g = G(vocab_size, hidden_size, topic_dim)
+
+        # G outputs keyed by the batch's document ids. Term frequencies
+        # depend only on the document, so every window of a document shares
+        # one G forward while G's parameters are unchanged; the cache is
+        # emptied whenever they may have moved.
+        self._g_cache = {}
+
+        # Zeroed initial hidden states keyed by batch size, reused across
+        # steps instead of allocated fresh each time.
+        self._hidden_buffers = {}
+
+        # W_1, W_2: Affines producing the variational Gaussian parameters.
+        self.w1 = nn.Linear(topic_dim, topic_dim)
+        self.w2 = nn.Linear(topic_dim, topic_dim)
+
+    def forward(self, input, hidden, theta):
+        """
+        Compute vocabulary logits for each time step.
+
+        :param input: torch.LongTensor
+            A (batch size, sequence length) tensor of word indices.
+
+        :param hidden: torch.Tensor
+            The RNN hidden state.
+
+        :param theta: torch.Tensor
+            The topic proportions, of dimensions (topic_dim,) for a single
+            document or (batch size, topic_dim) for a batch.
+
+        :return A ((batch size, sequence length, vocab size) logit tensor,
+            final hidden state) pair.
+        """
+        # Batches are staged as contiguous torch.long tensors; anything
+        # else makes the embedding lookup copy its input silently.
+        assert input.dtype == torch.long and input.is_contiguous()
+
+        embedded_passage = self.embedding(input).contiguous()
+        output, hidden = self.rnn(embedded_passage, hidden)
+        decoded = self.decoder(output)
+
+        return decoded + self._topic_additions(theta), hidden
+
+    def _topic_additions(self, theta):
+        """
+        The topic contributions to the logits for 'theta', masked for
+        stopwords and shaped to broadcast over the batch and sequence
+        dimensions.
+        """
+        # Topic additions collapse to one vocabulary-length vector per
+        # document: mask once, then let broadcasting spread the result over
+        # the batch and sequence dimensions with no (batch, length, vocab)
+        # temporaries.
+        topic_additions = (theta @ self.beta) * self.stop_mask
+        if topic_additions.dim() > 1:
+            # Batched theta: broadcast over the sequence dimension.
+            topic_additions = topic_additions.unsqueeze(1)
+
+        return topic_additions
+
+    def init_hidden(self, batch_size):
+        """
+        Produce a zeroed initial hidden state for the RNN.
+
+        One buffer is kept per batch size and handed out repeatedly — the
+        recurrent call never writes into its initial state, so the buffer
+        stays zero and reuse skips a per-step allocation on the model's
+        device.
+
+        :param batch_size: The number of sequences in the batch.
+        """
+        buffer = self._hidden_buffers.get(batch_size)
+        if buffer is None or buffer.device != self.beta.device:
+            buffer = torch.zeros(self.layers, batch_size, self.hidden_size,
+                                 device=self.beta.device)
+            self._hidden_buffers[batch_size] = buffer
+
+        return buffer
+
+    def advance_parameter_version(self):
+        """
+        Mark the inference network's parameters as updated. Call after
+        each optimizer step so cached G outputs are recomputed rather
+        than served stale.
+
+        Steps taken while G is frozen cannot have moved its parameters,
+        so they keep the cache intact — otherwise every lookup during a
+        frozen-G warmup would miss, the one phase where the cache saves
+        the most.
+        """
+        if any(p.requires_grad for p in self.g.parameters()):
+            self._g_cache.clear()
+
+    def likelihood(self, input, target, term_frequencies, hidden=None,
+                   document_ids=None):
+        """
+        Compute the negative evidence lower bound for a batch of windows:
+        reconstruction cross entropy plus the KL divergence between the
+        variational posterior over topic proportions and its prior.
+
+        The inference network and variational affines run under autocast
+        (BF16) on CUDA; their projections are bandwidth-bound and safe at
+        reduced precision. The KL closed form stays in FP32 since
+        exp(2 * log_sigma) is sensitive to rounding.
+
+        :param input: torch.LongTensor
+            A (batch size, sequence length) tensor of word indices.
+
+        :param target: torch.LongTensor
+            'input' shifted right by one word.
+
+        :param term_frequencies: torch.Tensor
+            A (batch size, vocab size) tensor of the term frequencies of
+            each window's source document.
+
+        :param hidden: torch.Tensor
+            The RNN hidden state, zeroed when omitted.
+
+        :param document_ids: torch.LongTensor
+            The ids of each window's source document; enables reuse of G's
+            output across the many windows that share a document.
+
+        :return A (loss, final hidden state) pair.
+        """
+        if hidden is None:
+            hidden = self.init_hidden(input.size(0))
+
+        with torch.amp.autocast('cuda', enabled=input.is_cuda,
+                                dtype=torch.bfloat16):
+            mapped_term_frequencies = self._mapped_term_frequencies(
+                term_frequencies, document_ids)
+            mu = self.w1(mapped_term_frequencies)
+            log_sigma = self.w2(mapped_term_frequencies)
+
+        mu = mu.float()
+        log_sigma = log_sigma.float()
+
+        # Reparameterization trick: theta stays differentiable in mu and
+        # log_sigma. The prior's covariance is the identity, so plain
+        # standard-normal noise sampled directly on device is equivalent
+        # to a MultivariateNormal draw, without the per-step Cholesky
+        # factorization or host-to-device copy.
+        epsilon = torch.randn_like(mu)
+        theta = mu + torch.exp(log_sigma) * epsilon
+
+        output, hidden = self.forward(input, hidden, theta)
+
+        # Fused log_softmax + nll kernel: with a vocabulary-sized logit
+        # tensor this halves the number of passes over it, and reshape
+        # avoids forcing an extra contiguity copy.
+        cross_entropy = F.cross_entropy(output.reshape(-1, self.vocab_size),
+                                        target.reshape(-1),
+                                        reduction='sum')
+
+        neg_kl_div = _negative_kl_divergence(mu, log_sigma)
+
+        # Normalize per token so the loss scale — and with it the usable
+        # learning-rate range — is independent of batch and window size.
+        return (cross_entropy - neg_kl_div) / target.numel(), hidden
+
+    def _mapped_term_frequencies(self, term_frequencies, document_ids):
+        """
+        G's output for a batch, served from the per-document cache when
+        safe: gradients disabled, or G frozen (e.g. a warmup phase), so
+        no autograd graph is retained across steps. The cache is emptied
+        whenever G's parameters may have moved, so entries never outlive
+        the weights that produced them.
+        """
+        g_frozen = not any(p.requires_grad for p in self.g.parameters())
+        cacheable = document_ids is not None and (
+            g_frozen or not torch.is_grad_enabled())
+        key = None
+        if cacheable:
+            key = tuple(document_ids.tolist())
+            cached = self._g_cache.get(key)
+            # Entries cached before a device move are recomputed.
+            if cached is not None:
+                if cached.device == term_frequencies.device:
+                    return cached
+
+        mapped = self.g(term_frequencies)
+        if cacheable:
+            self._g_cache[key] = mapped
+
+        return mapped
+
+
+class G(nn.Module):
+
+    def __init__(self, vc_dim, hidden_size, topic_dim, rank=256):
+        """
+        Inference network mapping a document's term-frequency vector to a
+        hidden representation from which the parameters of the variational
+        Gaussian over topic proportions are derived.
+
+        The first projection is factored through a low-rank bottleneck. A
+        single Linear(vc_dim, hidden_size * topic_dim) would dwarf the rest
+        of the model for realistic vocabularies (tens of thousands of
+        words); the factored pair costs vc_dim * rank plus
+        rank * hidden_size * topic_dim parameters instead, and the matching
+        matmuls shrink by the same ratio.
+
+        :param vc_dim: int
+            The size of the vocabulary, including stopwords.
+
+        :param hidden_size: int
+            The hidden size of the network's inner projection.
+
+        :param topic_dim: int
+            The number of topics the model will learn.
+
+        :param rank: int
+            The width of the bottleneck factoring the first projection.
+        """
+        super(G, self).__init__()
+
+        self.vc_dim = vc_dim
+        self.hidden_size = hidden_size
+        self.topic_dim = topic_dim
+        self.rank = rank
+
+        # Scalar hyperparameters only, mirroring TopicRNN.init_arguments.
+        self.init_arguments = {
+            "vc_dim": vc_dim,
+            "hidden_size": hidden_size,
+            "topic_dim": topic_dim,
+            "rank": rank
+        }
+
+        self.model = nn.Sequential(
+            nn.Linear(vc_dim, rank, bias=False),
+            nn.Linear(rank, hidden_size * topic_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_size * topic_dim, topic_dim),
+            nn.ReLU()
+        )
+
+    def forward(self, term_frequencies):
+        """
+        :param term_frequencies: torch.Tensor
+            A (batch size, vc_dim) tensor of document term frequencies.
+
+        :return A (batch size, topic_dim) hidden representation.
+        """
+        return self.model(term_frequencies)
@@ -4,10 +4,13 @@ import os
 import shutil
 import sys
 
+import numpy as np
 import torch
+from nltk.corpus import stopwords
 from torch import optim
 
 sys.path.append(os.path.join(os.path.dirname(__file__)))
+from Dictionary import Corpus
 from topic_rnn_rc.models.topic_rnn import TopicRNN
 
 logger = logging.getLogger(__name__)
@@ -66,8 +69,18 @@ def main():
                         help="Maximum number of words in the question.")
     parser.add_argument("--batch-size", type=int, default=64,
                         help="Batch size to use in training and evaluation.")
+    parser.add_argument("--embedding-size", type=int, default=128,
+                        help="Size of the learned word embeddings.")
     parser.add_argument("--hidden-size", type=int, default=256,
                         help="Hidden size to use in RNN and Attention models.")
+    parser.add_argument("--bptt-limit", type=int, default=30,
+                        help=("Number of words per window when truncating "
+                              "backpropagation through time."))
+    parser.add_argument("--corpus-cache-path", type=str,
+                        help=("'.npz' path at which to cache the encoded "
+                              "training corpus; later runs restore from it "
+                              "and skip JSON parsing while the training "
+                              "files are unchanged."))
     parser.add_argument("--num-epochs", type=int, default=25,
                         help="Number of epochs to train for.")
     parser.add_argument("--dropout", type=float, default=0.2,
@@ -86,8 +99,10 @@ def main():
                         help="Train or evaluate with GPU.")
     args = parser.parse_args()
 
-    # Set random seed for reproducibility.
+    # Set random seed for reproducibility. Shuffling in the data loaders
+    # runs on numpy, so it needs seeding alongside torch.
     torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
     if torch.cuda.is_available():
         if not args.cuda:
             logger.warning("\033[35mGPU available but not running with "
@@ -96,22 +111,75 @@ def main():
             torch.cuda.manual_seed(args.seed)
 
 
+    # Load the training corpus.
+    logger.info("Loading the conflicts training corpus")
+    corpus = Corpus(bptt_limit=args.bptt_limit)
+    train_paths = sorted(
+        os.path.join(args.conflict_train_path, name)
+        for name in os.listdir(args.conflict_train_path))
+    corpus.load(train_paths, cache_path=args.corpus_cache_path)
+
+    stop_words = set(stopwords.words('english'))
+    stop_indices = torch.LongTensor(
+        [index for index, word in enumerate(corpus.dictionary.index_to_word)
+         if word.lower() in stop_words])
+
     # Create model of the correct type.
     if args.model_type == "topic":
         logger.info("Building TopicRNN model")
-        model = TopicRNN(embedding_matrix, args.hidden_size, args.dropout)
+        model = TopicRNN(len(corpus.dictionary), args.embedding_size,
+                         args.hidden_size, stop_indices,
+                         dropout=args.dropout)
 
     logger.info(model)
+    if args.cuda:
+        model.cuda()
 
+    optimizer = optim.SGD(model.parameters(), lr=args.lr)
+    for _ in range(args.num_epochs):
+        train_epoch(model, corpus, optimizer, args.batch_size,
+                    cuda=args.cuda)
 
-def train_epoch(model):
+
+def train_epoch(model, corpus, optimizer, batch_size, cuda=False):
     """
-    Train the model for one epoch.
+    Train the model for one epoch with truncated backpropagation through
+    time over 'batch_size' parallel document streams: each stream's RNN
+    hidden state is carried forward between windows (detached so
+    gradients stop at window boundaries) and zeroed when the stream
+    starts a new document.
     """
 
     # Set model to training mode (activates dropout and other things).
     model.train()
 
+    device = torch.device("cuda" if cuda else "cpu")
+    hidden = None
+    for window in corpus.tbptt_loader(batch_size=batch_size):
+        input = window["input"].to(device, non_blocking=True)
+        target = window["target"].to(device, non_blocking=True)
+        term_frequency = window["term_frequency"].to(device,
+                                                     non_blocking=True)
+        if hidden is not None and hidden.size(1) != input.size(0):
+            # Streams retired at the end of the epoch; restart the state.
+            hidden = None
+        elif hidden is not None:
+            # Zero the rows whose stream moved to a new document.
+            hidden[:, window["reset"].to(device), :] = 0
+
+        loss, hidden = model.likelihood(input, target, term_frequency,
+                                        hidden=hidden,
+                                        document_ids=window["ids"])
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        model.advance_parameter_version()
+
+        # Carry the state into the next window without backpropagating
+        # through it.
+        hidden = hidden.detach()
+
 
 if __name__ == "__main__":
     main()